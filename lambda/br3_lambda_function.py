@@ -18,6 +18,13 @@ DIFF_OUTPUT_KEY_SUFFIX = "/mermaid/tgw_routing_diagram_diff.md"
 MAPPING_KEY_SUFFIX = "/extractsheet/tgw_mapping_table.jsonl" 
 # CFN YAMLファイル名の固定
 CFN_YAML_FILE_NAME = "tgw_routing_cfn.yaml"
+# 疎通成立エッジ行の固定部分 (ペアごとのf-string展開を避けるため事前に定義)
+REACHABILITY_EDGE_PREFIX = "        "
+REACHABILITY_EDGE_MID = " <-- 疎通成立 (Reachability) --> "
+# 伝播先を持たないRTB用の共有空集合
+EMPTY_NODE_SET = frozenset()
+# Agentペイロードから抽出するパラメータ名
+AGENT_PARAMETER_NAMES = frozenset(('bucket', 'dynamic_prefix'))
 
 
 # =========================================================================
@@ -300,6 +307,12 @@ def generate_diff_mermaid(current_code: str, previous_code: Optional[str]) -> Op
 # 解析ロジックヘルパー関数 (変更なし)
 # =========================================================================
 
+def get_rtb_node_id(logical_id: str) -> str:
+    """RTBの論理IDからMermaidのノードIDを生成する (例: TgwRTBHubdev801PrdTokyoAsp0101 -> RTBASP0101)"""
+    # 除去トークンは固定のため定数をインライン展開し、大文字化とアンダースコア除去まで1回の呼び出しで行う
+    suffix = logical_id.replace('TgwRTB', '').replace('Hubdev801PrdTokyoGcopm', '').replace('Hubdev801PrdTokyo', '')
+    return "RTB" + suffix.upper().replace('_', '')
+
 def get_attachment_info(logical_id):
     """CFnの論理IDからMermaidで安全なノードIDと表示名を生成する"""
     prefix_parts = logical_id.split('TGW')
@@ -360,10 +373,7 @@ def parse_cfn_and_generate_mermaid(yaml_data: str, asp_mapping: Dict[str, str])
         properties = props.get('Properties', {})
 
         if resource_type == 'AWS::EC2::TransitGatewayRouteTable':
-            suffix = logical_id.replace('TgwRTB', '')
-            suffix = suffix.replace('Hubdev801PrdTokyoGcopm', '').replace('Hubdev801PrdTokyo', '')
-            rtb_node_id = f"RTB{suffix.upper()}".replace('_', '')
-            rtb_map[logical_id] = rtb_node_id
+            rtb_map[logical_id] = get_rtb_node_id(logical_id)
 
         if resource_type in ['AWS::EC2::TransitGatewayRouteTableAssociation', 'AWS::EC2::TransitGatewayRouteTablePropagation']:
             att_id_ref = properties.get('TransitGatewayAttachmentId')
@@ -390,8 +400,10 @@ def parse_cfn_and_generate_mermaid(yaml_data: str, asp_mapping: Dict[str, str])
                 att_node_id = att_info['node_id']
                 
                 display_value = att_ref_for_display
-                if display_value.lower().startswith('tgw-attach-'):
-                    asp_name = asp_mapping.get(display_value.lower())
+                # 'tgw-attach-' で始まる値はAWSが発行した小文字のIDであり、asp_mappingのキーも
+                # load_asp_mapping で小文字化済みのため、呼び出しごとの .lower() は不要
+                if display_value.startswith('tgw-attach-'):
+                    asp_name = asp_mapping.get(display_value)
                     if asp_name:
                         display_value = asp_name
                 
@@ -427,20 +439,19 @@ def parse_cfn_and_generate_mermaid(yaml_data: str, asp_mapping: Dict[str, str])
         mermaid_lines.append(f"        ONPRE(ONPRE)")
 
     mermaid_lines.append("\n        %% 疎通成立 (Reachability) - AssociationとPropagationの双方向チェック")
-    all_nodes_for_check = sorted_att_nodes + ['ONPRE'] if 'ONPRE' not in att_display_info.keys() else sorted_att_nodes
-
-    for i, node_a in enumerate(all_nodes_for_check):
-        for node_b in all_nodes_for_check[i+1:]:
-            rtb_a_assoc = associations.get(node_a)
-            rtb_b_assoc = associations.get(node_b)
 
-            if node_a in sorted_att_nodes and node_b in sorted_att_nodes:
-                if not rtb_a_assoc or not rtb_b_assoc:
-                    continue
-                a_to_b = node_b in propagations.get(rtb_a_assoc, set())
-                b_to_a = node_a in propagations.get(rtb_b_assoc, set())
-                if a_to_b and b_to_a:
-                    mermaid_lines.append(f"        {node_a} <-- 疎通成立 (Reachability) --> {node_b}")
+    # ノードごとに「Association先RTBが伝播を受け付けるノード集合」を求め、
+    # 全ノードペアを走査する代わりに伝播で示される候補エッジのみを双方向チェックする
+    # (Associationを持たないノード、例: 補完したONPRE は reach に含まれない)
+    reach = {node: propagations.get(rtb_node, EMPTY_NODE_SET) for node, rtb_node in associations.items()}
+    reachable_pairs = sorted(
+        (node_a, node_b)
+        for node_a, targets in reach.items()
+        for node_b in targets
+        if node_a < node_b and node_a in reach.get(node_b, EMPTY_NODE_SET)
+    )
+    for node_a, node_b in reachable_pairs:
+        mermaid_lines.append(REACHABILITY_EDGE_PREFIX + node_a + REACHABILITY_EDGE_MID + node_b)
 
     mermaid_lines.append("\n      %% 注: 疎通成立はAssociationとPropagationの双方向の組み合わせに基づきます。")
     mermaid_lines.append("    end")
@@ -459,15 +470,25 @@ def extract_agent_parameters(event: Dict[str, Any]) -> Dict[str, str]:
         params['bucket'] = event['bucket']
     if 'dynamic_prefix' in event:
         params['dynamic_prefix'] = event['dynamic_prefix']
-    try:
-        properties = event['requestBody']['content']['application/json']['properties']
-        for prop in properties:
-            if prop['name'] == 'bucket':
-                params['bucket'] = prop['value']
-            elif prop['name'] == 'dynamic_prefix':
-                params['dynamic_prefix'] = prop['value']
-    except (KeyError, TypeError):
-        pass
+    # ネスト構造が欠けている、または辞書以外の値の場合も例外を使わずに空として扱う
+    request_body = event.get('requestBody')
+    content = request_body.get('content') if isinstance(request_body, dict) else None
+    json_content = content.get('application/json') if isinstance(content, dict) else None
+    properties = json_content.get('properties') if isinstance(json_content, dict) else None
+    if not isinstance(properties, (list, tuple)):
+        properties = ()
+
+    # 'value' を持たない要素はトップレベルの値を上書きせずに読み飛ばす
+    seen = set()
+    for prop in properties:
+        if not isinstance(prop, dict) or 'value' not in prop:
+            continue
+        name = prop.get('name')
+        if isinstance(name, str) and name in AGENT_PARAMETER_NAMES and name not in seen:
+            params[name] = prop['value']
+            seen.add(name)
+            if len(seen) == len(AGENT_PARAMETER_NAMES):
+                break
     return params
 
 def extract_agent_metadata(event: Dict[str, Any]) -> Dict[str, str]:
@@ -7,6 +7,7 @@ from typing import Dict, Any, Optional
 import time
 import secrets
 import string
+from botocore.config import Config
 from botocore.exceptions import ClientError
 
 # --------------------------------------------------------------------------
@@ -17,7 +18,12 @@ from botocore.exceptions import ClientError
 # Regionは環境変数から取得することを推奨
 REGION_NAME = os.environ.get('AWS_REGION', 'ap-northeast-1')
 sns_client = boto3.client('sns', region_name=REGION_NAME)
-dynamodb_client = boto3.client('dynamodb', region_name=REGION_NAME)
+# ウォームコンテナ間でTLS接続を再利用するため、TCP keepaliveとadaptiveリトライを有効化
+dynamodb_client = boto3.client(
+    'dynamodb',
+    region_name=REGION_NAME,
+    config=Config(retries={'mode': 'adaptive', 'max_attempts': 3}, tcp_keepalive=True)
+)
 
 # DynamoDBのテーブル名 (環境変数からの取得を推奨)
 DYNAMODB_TABLE_NAME = os.environ.get('DYNAMODB_TABLE_NAME', 'ShortenedUrlStore')
@@ -25,6 +31,8 @@ DYNAMODB_TABLE_NAME = os.environ.get('DYNAMODB_TABLE_NAME', 'ShortenedUrlStore')
 API_GATEWAY_BASE_URL = os.environ.get('API_GATEWAY_BASE_URL', 'https://<YOUR_API_ID>.execute-api.<REGION>.amazonaws.com/prod')
 # 短縮リンクの有効期限 (秒)。DynamoDBのTTLとして使用されます。
 URL_EXPIRATION_SECONDS = 3600 # 1時間
+# 短縮リンクの有効期限メッセージ (URL_EXPIRATION_SECONDS は定数のためインポート時に1回だけ生成)
+EXPIRATION_MESSAGE = f"（約{URL_EXPIRATION_SECONDS // 60}分間有効）"
 
 # --------------------------------------------------------------------------
 # DynamoDBへの保存ロジック (短縮キーの生成)
@@ -74,6 +82,32 @@ def store_urls_in_dynamodb(full_url: str, diff_url: Optional[str], yaml_url: Opt
 # SNSメッセージ本文生成 (短縮リンクを使用)
 # --------------------------------------------------------------------------
 
+# メッセージ本文はテンプレートに対する1回の format_map で組み立てる
+
+# 短縮リンクの構造: [API GWベースURL]/view?id=[ShortId]&type=[LinkType]
+DIAGRAM_LINKS_TEMPLATE = (
+    "--- ダイアグラムリンク " + EXPIRATION_MESSAGE + " ---\n"
+    "フルダイアグラム: <{api_base_url}/view?id={short_id}&type=full>\n"
+    "差分ダイアグラム: <{api_base_url}/view?id={short_id}&type=diff>\n"
+    "CFn YAML差分: <{api_base_url}/view?id={short_id}&type=yaml>\n\n"
+)
+
+# ShortIdの生成に失敗した場合の警告
+DIAGRAM_LINKS_FAILURE_MESSAGE = "警告: リンクの短縮に失敗しました。リンクはメールに含まれません。詳細についてはログを確認してください。\n\n"
+
+SNS_MESSAGE_TEMPLATE = (
+    "【S3オブジェクト承認リクエスト】\n\n"
+    "Transit Gatewayのルーティング図が更新されました。オブジェクトの承認または却下を行ってください。\n\n"
+    "--- オブジェクト詳細 ---\n"
+    "バケット名: {bucket_name}\n"
+    "メインオブジェクトキー: {object_key}\n\n"
+    "{diagram_links_section}" # 短縮リンクセクションの挿入
+    "--- アクションを選択してください ---\n"
+    "✅ 承認する: <{approval_link}>\n"
+    "❌ 却下する: <{rejection_link}>\n\n"
+    "（このメッセージはAWS Step Functionsワークフローから送信されました。）"
+)
+
 def build_sns_message(
     bucket_name: str, 
     object_key: str, 
@@ -84,43 +118,21 @@ def build_sns_message(
 ) -> str:
     """SNSでEメールサブスクリプション向けに送信するメッセージ本文を生成するヘルパー関数"""
 
-    # 短縮リンクの有効期限メッセージ
-    expiration_message = f"（約{URL_EXPIRATION_SECONDS // 60}分間有効）" 
-    
-    diagram_links_section = ""
     if short_id:
-        # 短縮リンクの構造: [API GWベースURL]/view?id=[ShortId]&type=[LinkType]
-        full_diagram_short_link = f"{api_base_url}/view?id={short_id}&type=full"
-        diff_diagram_short_link = f"{api_base_url}/view?id={short_id}&type=diff"
-        yaml_diff_short_link = f"{api_base_url}/view?id={short_id}&type=yaml"
-
-        diagram_links_section = (
-            f"--- ダイアグラムリンク {expiration_message} ---\n"
-            f"フルダイアグラム: <{full_diagram_short_link}>\n"
-            f"差分ダイアグラム: <{diff_diagram_short_link}>\n"
-            f"CFn YAML差分: <{yaml_diff_short_link}>\n\n"
-        )
+        diagram_links_section = DIAGRAM_LINKS_TEMPLATE.format_map({
+            'api_base_url': api_base_url,
+            'short_id': short_id
+        })
     else:
-        # ShortIdの生成に失敗した場合は警告
-        diagram_links_section = "警告: リンクの短縮に失敗しました。リンクはメールに含まれません。詳細についてはログを確認してください。\n\n"
-
-
-    plain_text = (
-        f"【S3オブジェクト承認リクエスト】\n\n"
-        f"Transit Gatewayのルーティング図が更新されました。オブジェクトの承認または却下を行ってください。\n\n"
-        f"--- オブジェクト詳細 ---\n"
-        f"バケット名: {bucket_name}\n"
-        f"メインオブジェクトキー: {object_key}\n\n"
-        
-        f"{diagram_links_section}" # 短縮リンクセクションの挿入
-        
-        f"--- アクションを選択してください ---\n"
-        f"✅ 承認する: <{approval_link}>\n"
-        f"❌ 却下する: <{rejection_link}>\n\n"
-        f"（このメッセージはAWS Step Functionsワークフローから送信されました。）"
-    )
-
-    return plain_text
+        diagram_links_section = DIAGRAM_LINKS_FAILURE_MESSAGE
+
+    return SNS_MESSAGE_TEMPLATE.format_map({
+        'bucket_name': bucket_name,
+        'object_key': object_key,
+        'diagram_links_section': diagram_links_section,
+        'approval_link': approval_link,
+        'rejection_link': rejection_link
+    })
 
 # --------------------------------------------------------------------------
 # Lambda エントリポイント
@@ -1,12 +1,18 @@
 import json
 import os
 import boto3
+from botocore.config import Config
 from botocore.exceptions import ClientError # <-- ここを追加
 from typing import Dict, Any
 
 # DynamoDB クライアントの初期化
 # Regionは環境変数から取得することを推奨
-dynamodb_client = boto3.client('dynamodb', region_name=os.environ.get('AWS_REGION', 'ap-northeast-1'))
+# ウォームコンテナ間でTLS接続を再利用するため、TCP keepaliveとadaptiveリトライを有効化
+dynamodb_client = boto3.client(
+    'dynamodb',
+    region_name=os.environ.get('AWS_REGION', 'ap-northeast-1'),
+    config=Config(retries={'mode': 'adaptive', 'max_attempts': 3}, tcp_keepalive=True)
+)
 
 # 環境変数からテーブル名を取得 (前のLambdaと一致させる)
 DYNAMODB_TABLE_NAME = os.environ.get('DYNAMODB_TABLE_NAME', 'ShortenedUrlStore')
@@ -4,8 +4,16 @@ import boto3
 import datetime
 import time
 from botocore.config import Config
+from botocore.credentials import DeferredRefreshableCredentials
 from botocore.exceptions import ClientError, WaiterError
-from typing import Dict, Any, Union, List
+from botocore.session import get_session
+from typing import Dict, Any, Union, List, Optional, Tuple
+
+try:
+    # Lambdaレイヤーで提供されている場合のみ高速なorjsonを使用する (未導入の環境では標準のjsonを使用)
+    import orjson
+except ImportError:
+    orjson = None
 
 # =========================================================================
 # Configuration (Step Functionsの入力から取得できない定数を定義)
@@ -24,64 +32,133 @@ REGION = 'ap-northeast-1'
 TGW_ID_CONFIG_FILENAME = "tgw_id_config.jsonl"
 ACCOUNT_ID_CONFIG_FILENAME = "target_account.jsonl" 
 
+# 設定ファイル読み込み用のS3クライアント (グローバルに定義し、ウォームコンテナ間で再利用する)
+s3 = boto3.client('s3', config=Config(retries={'max_attempts': 3}))
+
+# AssumeRole用のSTSクライアント (グローバルに定義し、ウォームコンテナ間で再利用する)
+# グローバルエンドポイントではなく同一リージョンのSTSエンドポイントを使用し、スロットリングはadaptiveリトライで吸収する
+sts = boto3.client(
+    'sts',
+    region_name=REGION,
+    endpoint_url=f"https://sts.{REGION}.amazonaws.com",
+    config=Config(retries={'max_attempts': 10, 'mode': 'adaptive'})
+)
+
+# AssumeRoleで生成したクライアントのキャッシュ (ウォームコンテナ間で再利用し、STS呼び出しを省略する)
+# キー: (account_id, role_name, service, region) -> クライアント
+# 認証情報は有効期限が近づくとクライアント側で自動的に再AssumeRoleされるため、期限はキャッシュで管理しない
+ASSUMED_ROLE_CLIENT_CACHE: Dict[Tuple[str, str, str, str], Any] = {}
+
+# AssumeRole後のクライアントに適用する設定 (呼び出しごとにConfigを生成せず、モジュールロード時に1度だけ作成)
+# 短い間隔のポーリングによるDescribeStacksのスロットリングをadaptiveリトライで吸収する
+ASSUMED_ROLE_CLIENT_CONFIG = Config(retries={'max_attempts': 10, 'mode': 'adaptive'})
+
+# 既存スタックがロールバック後のクリーンアップ中の場合の待機設定 (3秒間隔、最大2分)
+ROLLBACK_CLEANUP_WAITER_CONFIG = {'Delay': 3, 'MaxAttempts': 40}
+
+# 変更セット作成の待機設定 (通常数秒で完了するため2秒間隔、最大150秒)
+CHANGE_SET_WAITER_CONFIG = {'Delay': 2, 'MaxAttempts': 75}
+# スタック操作完了の待機設定 (3秒間隔、最大9分)
+# ロールバッククリーンアップ (120秒)・変更セット作成 (150秒) と合わせた待機の最悪値は810秒とし、Lambdaの最大実行時間 (15分) 内に
+# S3読み込み・AssumeRole・変更セット実行とWaiterError時の最終ステータス取得を収める
+STACK_OPERATION_WAITER_CONFIG = {'Delay': 3, 'MaxAttempts': 180}
+
 # =========================================================================
 # Helper Functions
 # =========================================================================
 
 def assume_role_and_get_client(account_id: str, role_name: str, service: str, region: str):
-    """ターゲットアカウントにAssumeRoleし、指定されたサービス用のクライアントを返す。"""
-    try:
-        sts_client = boto3.client('sts', region_name=region)
-        session_name = f"{service.replace(':', '')}DeploymentSession"
-        
-        print(f"[INFO] Attempting to AssumeRole: arn:aws:iam::{account_id}:role/{role_name}")
-        assumed_role_object = sts_client.assume_role(
-            RoleArn=f"arn:aws:iam::{account_id}:role/{role_name}",
+    """
+    ターゲットアカウントにAssumeRoleし、指定されたサービス用のクライアントを返す。
+    認証情報はDeferredRefreshableCredentialsで保持し、長時間のスタック操作中に期限切れとなる前に自動で再取得する。
+    """
+    cache_key = (account_id, role_name, service, region)
+    cached_client = ASSUMED_ROLE_CLIENT_CACHE.get(cache_key)
+    if cached_client:
+        print(f"[INFO] Reusing cached {service} client for account {account_id}.")
+        return cached_client
+
+    role_arn = f"arn:aws:iam::{account_id}:role/{role_name}"
+    session_name = f"{service.replace(':', '')}DeploymentSession"
+
+    def refresh_credentials() -> Dict[str, str]:
+        """AssumeRoleを実行し、botocoreのリフレッシュ形式で一時認証情報を返す (初回取得と期限前の再取得で呼ばれる)"""
+        print(f"[INFO] Attempting to AssumeRole: {role_arn}")
+        credentials = sts.assume_role(
+            RoleArn=role_arn,
             RoleSessionName=session_name
+        )['Credentials']
+        return {
+            'access_key': credentials['AccessKeyId'],
+            'secret_key': credentials['SecretAccessKey'],
+            'token': credentials['SessionToken'],
+            'expiry_time': credentials['Expiration'].isoformat()
+        }
+
+    try:
+        credentials = DeferredRefreshableCredentials(
+            method='sts-assume-role',
+            refresh_using=refresh_credentials
         )
-        credentials = assumed_role_object['Credentials']
+        # 初回のAssumeRoleをここで実行し、権限エラー等を最初のAPI呼び出しまで遅延させずに検知する
+        credentials.get_frozen_credentials()
         
         print(f"[INFO] Successfully assumed role in account {account_id} for {service} deployment.")
         
-        return boto3.client(
+        botocore_session = get_session()
+        botocore_session._credentials = credentials
+        client = boto3.Session(botocore_session=botocore_session).client(
             service,
-            aws_access_key_id=credentials['AccessKeyId'],
-            aws_secret_access_key=credentials['SecretAccessKey'],
-            aws_session_token=credentials['SessionToken'],
             region_name=region,
-            config=Config(retries={'max_attempts': 3})
+            config=ASSUMED_ROLE_CLIENT_CONFIG
         )
+        ASSUMED_ROLE_CLIENT_CACHE[cache_key] = client
+        return client
     except ClientError as e:
         print(f"[ERROR] Failed to assume role in account {account_id}: {e}")
         raise 
 
+def json_loads(data: Union[str, bytes]) -> Any:
+    """JSONをパースする (orjsonが利用可能な場合はbytesをデコードせずにそのままパースする)"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def json_dumps(obj: Any) -> str:
+    """JSON文字列を生成する (Lambdaのレスポンスbodyはstrである必要があるため、orjsonの出力はデコードする)"""
+    if orjson is not None:
+        return orjson.dumps(obj).decode('utf-8')
+    return json.dumps(obj)
+
 def fetch_s3_json_data(bucket: str, key: str) -> Union[Dict[str, Any], List[Any], None]:
-    """S3からJSONファイルを読み込む"""
-    s3 = boto3.client('s3')
+    """S3からJSON/JSONLファイルを読み込み、最初のレコードを返す"""
     try:
         print(f"[INFO] Attempting to fetch S3 data: s3://{bucket}/{key}")
         response = s3.get_object(Bucket=bucket, Key=key)
         
-        content = response['Body'].read().decode('utf-8').strip()
-        if not content:
-            return None
-        
-        # JSONLを考慮し、最初の行のみパースを試みる
+        # JSONLを考慮し、ファイル全体を読み込まずに空行を除いた最初の行のみをストリーミングで取得してパースする
+        body = response['Body']
         try:
-            return json.loads(content)
-        except json.JSONDecodeError:
-            first_line = content.split('\n')[0].strip()
-            if first_line:
-                return json.loads(first_line)
-            return None
+            lines = body.iter_lines(chunk_size=4096)
+            content = next((line for line in lines if line.strip()), b'').strip()
+            if not content:
+                return None
+            try:
+                return json_loads(content)
+            except json.JSONDecodeError:
+                # 複数行にわたるJSONの場合は残りの行も読み込み、全体をパースする
+                return json_loads(b'\n'.join([content, *lines]))
+        finally:
+            # 残りのデータは転送させずに接続を閉じる
+            body.close()
 
     except ClientError as e:
         if e.response['Error']['Code'] == 'NoSuchKey':
             return None
         raise 
 
-def get_target_account_id(bucket: str, prefix: str) -> str:
-    """tgw_id_config.jsonlからターゲットアカウントIDを読み込む"""
+def get_tgw_config(bucket: str, prefix: str) -> Tuple[str, str]:
+    """tgw_id_config.jsonlを1回だけ読み込み、(ターゲットアカウントID, TGW ID) を返す"""
     key = f"{prefix}/extractsheet/{TGW_ID_CONFIG_FILENAME}"
     data = fetch_s3_json_data(bucket, key)
     
@@ -89,36 +166,45 @@ def get_target_account_id(bucket: str, prefix: str) -> str:
         raise Exception(f"Required file not found: s3://{bucket}/{key}")
         
     if isinstance(data, list) and data:
-        account_id = data[0].get('account id')
+        target_data = data[0]
     elif isinstance(data, dict):
-        account_id = data.get('account id')
+        target_data = data
     else:
-        raise Exception(f"Failed to parse target account ID from {key}. Invalid data format.")
+        raise Exception(f"Failed to parse target account ID and TGW ID from {key}. Invalid data format.")
+
+    account_id = target_data.get('account id')
+    tgw_id = target_data.get('tgw_id')
 
     if not account_id:
         raise Exception(f"Target account ID ('account id' key) is missing in {key}.")
         
-    return str(account_id)
-
-def get_tgw_id(bucket: str, prefix: str) -> str:
-    """tgw_id_config.jsonlからTGW IDを読み込む"""
-    key = f"{prefix}/extractsheet/{TGW_ID_CONFIG_FILENAME}"
-    data = fetch_s3_json_data(bucket, key)
-    
-    if data is None:
-        raise Exception(f"Required file not found: s3://{bucket}/{key}")
-        
-    if isinstance(data, list) and data:
-        tgw_id = data[0].get('tgw_id')
-    elif isinstance(data, dict):
-        tgw_id = data.get('tgw_id')
-    else:
-        raise Exception(f"Failed to parse TGW ID from {key}. Invalid data format.")
-    
     if not tgw_id:
         raise Exception(f"TGW ID is missing in {key}.")
         
-    return str(tgw_id)
+    return str(account_id), str(tgw_id)
+
+def get_target_account_id(bucket: str, prefix: str) -> str:
+    """tgw_id_config.jsonlからターゲットアカウントIDを読み込む (互換性維持)"""
+    return get_tgw_config(bucket, prefix)[0]
+
+def get_tgw_id(bucket: str, prefix: str) -> str:
+    """tgw_id_config.jsonlからTGW IDを読み込む (互換性維持)"""
+    return get_tgw_config(bucket, prefix)[1]
+
+
+def get_stack_status(cfn_client, stack_name: str) -> Optional[str]:
+    """
+    スタックの現在のステータスを返す。スタックが存在しない場合はNoneを返す。
+    存在確認とステータス取得を1回のDescribeStacksで兼ねる。
+    """
+    try:
+        response = cfn_client.describe_stacks(StackName=stack_name)
+    except ClientError as e:
+        error = e.response.get('Error', {})
+        if error.get('Code') == 'ValidationError' and 'does not exist' in error.get('Message', ''):
+            return None
+        raise
+    return response['Stacks'][0]['StackStatus']
 
 
 def wait_for_change_set(cfn_client, stack_name: str, change_set_id: str, request_id: str):
@@ -130,7 +216,7 @@ def wait_for_change_set(cfn_client, stack_name: str, change_set_id: str, request
         waiter.wait(
             ChangeSetName=change_set_id,
             StackName=stack_name,
-            WaiterConfig={'Delay': 5, 'MaxAttempts': 30}
+            WaiterConfig=CHANGE_SET_WAITER_CONFIG
         )
         print(f"[INFO] {request_id} Change Set {change_set_id} created successfully.")
     except WaiterError as e:
@@ -155,7 +241,7 @@ def wait_for_stack_operation(cfn_client, stack_name: str, operation_type: str, r
         print(f"[INFO] {request_id} Waiting for stack {stack_name} to complete {operation_type}...")
         waiter.wait(
             StackName=stack_name,
-            WaiterConfig={'Delay': 10, 'MaxAttempts': 60}
+            WaiterConfig=STACK_OPERATION_WAITER_CONFIG
         )
         print(f"[INFO] {request_id} Stack {stack_name} completed {operation_type}_COMPLETE successfully.")
     except WaiterError as e:
@@ -200,9 +286,8 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         print(f"[INFO] {request_id} Dynamically constructed CFN Assume Role Name: {cfn_assume_role_name}")
         # ★★★ 修正終わり ★★★
 
-        # ターゲットアカウントIDとTGW IDを取得 (両方 tgw_id_config.jsonl を参照)
-        target_account_id = get_target_account_id(YAML_BUCKET, dynamic_prefix)
-        tgw_id = get_tgw_id(YAML_BUCKET, dynamic_prefix)
+        # ターゲットアカウントIDとTGW IDを取得 (tgw_id_config.jsonl を1回のGETで参照)
+        target_account_id, tgw_id = get_tgw_config(YAML_BUCKET, dynamic_prefix)
 
         print(f"[INFO] {request_id} Target Account ID fetched: {target_account_id}")
         print(f"[INFO] {request_id} TGW ID fetched: {tgw_id}")
@@ -233,30 +318,27 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         change_set_type = 'CREATE' 
         
         # ★★★ 既存スタックのステータスチェックと待機ロジック ★★★
-        while True:
+        # スタックが存在するか確認 (存在しない場合はNone)
+        current_stack_status = get_stack_status(cfn_client, stack_name)
+        
+        if current_stack_status is None:
+            print(f"[INFO] {request_id} Stack {stack_name} does not exist. Creating CREATE Change Set.")
+        elif current_stack_status == 'UPDATE_ROLLBACK_COMPLETE_CLEANUP_IN_PROGRESS':
+            # クリーンアップ完了 (UPDATE_ROLLBACK_COMPLETE) をWaiterで待機し、完了次第UPDATEとして続行する
+            print(f"[WARNING] {request_id} Stack is in {current_stack_status}. Waiting for rollback cleanup to complete...")
             try:
-                # スタックが存在するか確認
-                response = cfn_client.describe_stacks(StackName=stack_name)
-                current_stack_status = response['Stacks'][0]['StackStatus']
-                
-                if current_stack_status == 'UPDATE_ROLLBACK_COMPLETE_CLEANUP_IN_PROGRESS':
-                    print(f"[WARNING] {request_id} Stack is in {current_stack_status}. Waiting 10 seconds before retry.")
-                    time.sleep(10)
-                elif current_stack_status not in ['DELETE_COMPLETE']:
-                    change_set_type = 'UPDATE'
-                    print(f"[INFO] {request_id} Stack {stack_name} exists. Creating UPDATE Change Set.")
-                    break # 有効な状態であればループを抜ける
-                else:
-                    # スタックがDELETE_COMPLETEの場合はCREATE
-                    break # ループを抜ける
-
-            except ClientError as e:
-                if 'does not exist' in str(e):
-                    change_set_type = 'CREATE'
-                    print(f"[INFO] {request_id} Stack {stack_name} does not exist. Creating CREATE Change Set.")
-                    break # ループを抜ける
-                else:
-                    raise e
+                cfn_client.get_waiter('stack_rollback_complete').wait(
+                    StackName=stack_name,
+                    WaiterConfig=ROLLBACK_CLEANUP_WAITER_CONFIG
+                )
+            except WaiterError as e:
+                raise Exception(f"{request_id} Stack {stack_name} did not reach UPDATE_ROLLBACK_COMPLETE after rollback cleanup: {e}") from e
+            change_set_type = 'UPDATE'
+            print(f"[INFO] {request_id} Stack {stack_name} rollback cleanup completed. Creating UPDATE Change Set.")
+        elif current_stack_status != 'DELETE_COMPLETE':
+            change_set_type = 'UPDATE'
+            print(f"[INFO] {request_id} Stack {stack_name} exists. Creating UPDATE Change Set.")
+        # スタックがDELETE_COMPLETEの場合はCREATE
         # ★★★ 待機ロジック終了 ★★★
         
         # 6. Change Setの作成
@@ -291,7 +373,7 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         
         return {
             'statusCode': 200,
-            'body': json.dumps(f"CFN Deployment successful for stack {stack_name}.")
+            'body': json_dumps(f"CFN Deployment successful for stack {stack_name}.")
         }
 
     except Exception as e:
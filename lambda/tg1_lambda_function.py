@@ -1,15 +1,26 @@
+import datetime
+import functools
+import gzip
 import json
 import logging
 import os
 import traceback
 import re
-from io import StringIO
+import textwrap
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Dict, List, Any, Set, Tuple, Union
 
 import boto3
+from botocore.config import Config
 from botocore.exceptions import ClientError
 import yaml
 
+try:
+    # Lambdaレイヤーで提供されている場合のみ高速なorjsonを使用する (未導入の環境では標準のjsonを使用)
+    import orjson
+except ImportError:
+    orjson = None
+
 # --- 1. 定数の定義と初期設定 ---
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -35,6 +46,12 @@ TGW_CONFIG_INPUT_FILENAME = "tgw_id_config.jsonl"
 
 # TGW伝播がアクティブな状態を示すAWS APIステータス
 ACTIVE_PROPAGATION_STATES = ['enabled', 'propagated']
+# RTBごとのPropagation取得APIを並列実行する最大スレッド数
+PROPAGATION_FETCH_MAX_WORKERS = 16
+# 生成した成果物 (CFn YAML / マッピング / タスク / インポートマッピング) を並列アップロードする最大スレッド数
+S3_UPLOAD_MAX_WORKERS = 4
+# describe_transit_gateway_* の1ページあたりの取得件数 (MaxResultsの上限値1000とし、API呼び出し回数を減らす)
+DESCRIBE_PAGE_SIZE = 1000
 
 # TGW設定ファイルから取得されるキー名
 TGW_ID_KEY = 'tgw_id'
@@ -42,29 +59,111 @@ ACCOUNT_ID_KEY = 'account id'
 
 # Boto3クライアント（グローバルに定義）
 s3 = boto3.client('s3')
-sts = boto3.client('sts') 
+# STSはAssumeRoleのスロットリングをadaptiveリトライで吸収する
+sts = boto3.client('sts', config=Config(retries={'max_attempts': 10, 'mode': 'adaptive'}))
+
+# クロスアカウントのEC2クライアントを生成するリージョン
+TGW_REGION = 'ap-northeast-1'
+
+# AssumeRole後のEC2クライアントに適用する設定 (モジュールロード時に1度だけ作成)
+# Propagation取得の並列スレッド数に合わせてコネクションプールを確保し、スロットリングはadaptiveリトライで吸収する
+EC2_CLIENT_CONFIG = Config(
+    retries={'max_attempts': 10, 'mode': 'adaptive'},
+    max_pool_connections=PROPAGATION_FETCH_MAX_WORKERS
+)
+
+# AssumeRoleで生成したクライアントのキャッシュ (ウォームコンテナ間で再利用し、STS呼び出しを省略する)
+# キー: (account_id, role_name, service, region) -> (クライアント, 一時認証情報の有効期限)
+ASSUMED_ROLE_CLIENT_CACHE: Dict[Tuple[str, str, str, str], Tuple[Any, datetime.datetime]] = {}
+# 一時認証情報の残り有効期間がこれを下回る場合はAssumeRoleをやり直す
+ASSUMED_ROLE_REFRESH_MARGIN = datetime.timedelta(seconds=120)
+
+# 命名規則ヘルパーで使用する正規表現 (生成ループ内での再コンパイル/キャッシュ参照を避けるため事前にコンパイル)
+TGW_ID_RE = re.compile(r'^tgw-[0-9a-f]{17}$')
+NON_ALNUM_RE = re.compile(r'[^a-zA-Z0-9]+')
+PROJECT_PREFIX_RE = re.compile(r'^YOUR_PROJECT_PREFIX_?')
+ATTACHMENT_WORD_RE = re.compile(r'(TGW)?_?ATTACH(MENT)?')
+GCOPM_PREFIX_RE = re.compile(r'^GCOPM_?')
+MULTI_UNDERSCORE_RE = re.compile(r'_+')
+NON_UPPER_ALNUM_RE = re.compile(r'[^A-Z0-9]+')
+# タスクIDのサフィックス抽出 (extract_rtb_suffix) で使用する正規表現
+RTB_SUFFIX_RE = re.compile(r'-tokyo-([a-zA-Z0-9_-]+)-rtb$')
+NON_UPPER_ALNUM_UNDERSCORE_RE = re.compile(r'[^A-Z0-9_]+')
+
+# generate_* 関数が返すS3アップロード対象の成果物 (S3キー, 本文, Content-Type, gzip圧縮の要否)
+S3Payload = Tuple[str, Union[str, bytes, bytearray], str, bool]
+
+# gzip圧縮対象の成果物でも、これより小さい場合は圧縮せずにアップロードする (バイト)
+GZIP_MIN_SIZE_BYTES = 8192
+# 圧縮率よりも速度を優先した圧縮レベル
+GZIP_COMPRESS_LEVEL = 1
+
+# YAML出力に使用するDumperの基底クラス (libyaml のC実装が利用可能な場合はCSafeDumperを使用する)
+YAML_BASE_DUMPER = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
 
 # YAMLセクション区切りコメント
 RTB_SEP = "\n# =========================================================================\n# --- TransitGatewayRouteTable Resources ---\n# =========================================================================\n"
 ASSOC_SEP = "\n# =========================================================================\n# --- TransitGatewayRouteTableAssociation Resources ---\n# =========================================================================\n"
 PROP_SEP = "\n# =========================================================================\n# --- TransitGatewayRouteTablePropagation Resources ---\n# =========================================================================\n"
+# バッファへ直接書き込むためにUTF-8エンコード済みの固定文字列
+RESOURCES_KEY_B = b"Resources:\n"
+RTB_SEP_B = RTB_SEP.encode('utf-8')
+ASSOC_SEP_B = ASSOC_SEP.encode('utf-8')
+PROP_SEP_B = PROP_SEP.encode('utf-8')
 
 
 # --- 2. 補助関数 ---
-def upload_to_s3(bucket: str, key: str, data: str, content_type: str = 'application/json') -> None:
-    """S3にデータをアップロードする共通関数"""
+def json_loads(data: Union[str, bytes]) -> Any:
+    """JSONをパースする (orjsonが利用可能な場合はbytesをデコードせずにそのままパースする)"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def json_dumps(obj: Any) -> bytes:
+    """
+    JSONを区切り文字に空白を含まないコンパクト形式のUTF-8バイト列として出力する
+    (orjsonが利用可能な場合はorjsonを使用する)。
+    """
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+def upload_to_s3(bucket: str, key: str, data: Union[str, bytes, bytearray], content_type: str = 'application/json', compress: bool = False) -> None:
+    """
+    S3にデータをアップロードする共通関数 (バイト列はエンコードせずにそのまま送信する)。
+    compress=Trueかつ一定サイズ以上の場合はgzip圧縮し、ContentEncoding='gzip' を付与してアップロードする。
+    """
+    body = data if isinstance(data, (bytes, bytearray, memoryview)) else data.encode('utf-8')
+    extra_args = {}
+    if compress and len(body) > GZIP_MIN_SIZE_BYTES:
+        body = gzip.compress(body, compresslevel=GZIP_COMPRESS_LEVEL)
+        extra_args['ContentEncoding'] = 'gzip'
     try:
         s3.put_object(
             Bucket=bucket,
             Key=key,
-            Body=data.encode('utf-8'),
-            ContentType=content_type
+            Body=body,
+            ContentType=content_type,
+            # 長さは既知のため明示し、botocore側での長さ判定を省略する
+            ContentLength=len(body),
+            **extra_args
         )
-        logger.info(f"Successfully uploaded data to s3://{bucket}/{key}")
+        logger.info("Successfully uploaded data to s3://%s/%s", bucket, key)
     except Exception as e:
         logger.error(f"Error uploading to S3: {e}")
         raise
 
+def upload_payloads_to_s3(payloads: List[S3Payload]) -> None:
+    """生成した複数の成果物 (S3キー, 本文, Content-Type, gzip圧縮の要否) を並列でS3にアップロードする"""
+    with ThreadPoolExecutor(max_workers=min(S3_UPLOAD_MAX_WORKERS, len(payloads))) as executor:
+        futures = [
+            executor.submit(upload_to_s3, YAML_BUCKET, s3_key, body, content_type, compress)
+            for s3_key, body, content_type, compress in payloads
+        ]
+        # いずれかのアップロードが失敗した場合は例外を呼び出し元に伝播させる
+        for future in futures:
+            future.result()
+
 def get_tgw_config_from_s3(s3_path: str) -> Dict[str, str]:
     """S3パスからTGW IDとアカウントIDを含むJSONLファイルを読み込み、最初のレコードを取得する"""
     try:
@@ -77,19 +176,25 @@ def get_tgw_config_from_s3(s3_path: str) -> Dict[str, str]:
         key = s3_parts[1]
 
         response = s3.get_object(Bucket=bucket, Key=key)
-        # BodyはJSONLなので、一行目を読み込む
-        content = response['Body'].read().decode('utf-8').splitlines()[0]
-        
-        # JSONLをパース
-        config_data = json.loads(content)
+        # BodyはJSONLなので、ファイル全体を読み込まずに最初のレコード (空行を除く最初の行) のみをストリーミングで取得する
+        body = response['Body']
+        try:
+            first_record = next((line for line in body.iter_lines(chunk_size=4096) if line.strip()), b'')
+        finally:
+            # 残りのデータは転送させずに接続を閉じる
+            body.close()
+        content = first_record.strip()
+        
+        # JSONLをパース (bytesのまま渡す)
+        config_data = json_loads(content)
         
         tgw_id = config_data.get(TGW_ID_KEY)
         account_id = config_data.get(ACCOUNT_ID_KEY) 
 
         if not tgw_id or not account_id:
-            raise ValueError(f"Required keys ('{TGW_ID_KEY}' and '{ACCOUNT_ID_KEY}') not found in JSONL content: {content}")
+            raise ValueError(f"Required keys ('{TGW_ID_KEY}' and '{ACCOUNT_ID_KEY}') not found in JSONL content: {content.decode('utf-8')}")
         
-        if not re.match(r'^tgw-[0-9a-f]{17}$', tgw_id):
+        if not TGW_ID_RE.match(tgw_id):
             logger.warning(f"Extracted TGW ID '{tgw_id}' does not look like a valid TGW ID. Proceeding anyway.")
             
         logger.info(f"Successfully retrieved TGW ID: {tgw_id} and TGW Owner Account ID: {account_id} from {s3_path}")
@@ -110,6 +215,15 @@ def get_tgw_config_from_s3(s3_path: str) -> Dict[str, str]:
 def assume_cross_account_role(account_id: str, role_name: str, session_name: str = "TGWExtractorSession") -> boto3.client:
     """別アカウントのIAMロールを引き受ける (AssumeRole)"""
     role_arn = f'arn:aws:iam::{account_id}:role/{role_name}'
+
+    cache_key = (account_id, role_name, 'ec2', TGW_REGION)
+    cached = ASSUMED_ROLE_CLIENT_CACHE.get(cache_key)
+    if cached:
+        cached_client, expiration = cached
+        if expiration - datetime.datetime.now(datetime.timezone.utc) > ASSUMED_ROLE_REFRESH_MARGIN:
+            logger.info(f"Reusing cached EC2 client for role {role_arn} (expires at {expiration.isoformat()}).")
+            return cached_client
+
     logger.info(f"Attempting to assume role: {role_arn} in account {account_id}")
     
     try:
@@ -119,13 +233,16 @@ def assume_cross_account_role(account_id: str, role_name: str, session_name: str
         )
         credentials = response['Credentials']
         
-        return boto3.client(
+        client = boto3.client(
             'ec2',
             aws_access_key_id=credentials['AccessKeyId'],
             aws_secret_access_key=credentials['SecretAccessKey'],
             aws_session_token=credentials['SessionToken'],
-            region_name='ap-northeast-1' 
+            region_name=TGW_REGION,
+            config=EC2_CLIENT_CONFIG
         )
+        ASSUMED_ROLE_CLIENT_CACHE[cache_key] = (client, credentials['Expiration'])
+        return client
         
     except ClientError as e:
         error_code = e.response.get('Error', {}).get('Code')
@@ -142,9 +259,10 @@ def assume_cross_account_role(account_id: str, role_name: str, session_name: str
 # --- 3. 命名規則ヘルパー関数 ---
 def to_pascal_case(name: str) -> str:
     """ハイフン、ドット、スペース、アンダースコアを削除し、PascalCaseに変換する"""
-    words = re.split(r'[^a-zA-Z0-9]+', name)
-    return "".join(word.capitalize() for word in words if word)
+    return "".join(map(str.capitalize, filter(None, NON_ALNUM_RE.split(name))))
 
+# 命名変換は入力文字列のみに依存する純粋関数のため、同一名の再計算 (Association/Propagationで重複) をキャッシュで省略する
+@functools.lru_cache(maxsize=4096)
 def get_rtb_cfn_name(rtb_name: str) -> str:
     """RTBのCFn論理IDを生成する (例: Hubdev801PrdTokyoAsp0101RTB)"""
     # 1. PascalCaseに変換
@@ -158,20 +276,21 @@ def get_rtb_cfn_name(rtb_name: str) -> str:
     
     return final_name
 
+@functools.lru_cache(maxsize=4096)
 def get_attach_cfn_prefix(attach_name: str) -> str:
     """
     Association/PropagationリソースID用のシンプルなAttachment名プレフィックスを生成する (例: ONPRE, SHARED, ASP0101)。
     Attachment名に含まれる冗長なTGW/ATTACHメント/GCOPM関連の文字列を削除するよう、ロジックを強化。
     """
     # 1. すべて大文字に変換し、非英数字をアンダースコアに置換
-    upper_name = re.sub(r'[^a-zA-Z0-9]+', '_', attach_name.upper()) 
+    upper_name = NON_ALNUM_RE.sub('_', attach_name.upper()) 
     
     # 2. 環境固有の冗長なプレフィックスを削除
-    cleaned_name = re.sub(r'^YOUR_PROJECT_PREFIX_?', '', upper_name)
+    cleaned_name = PROJECT_PREFIX_RE.sub('', upper_name)
     
     # 3. Attachment関連の冗長な部分を削除
     # TGW/ATTACH/MENTなどの文字列を削除
-    cleaned_name = re.sub(r'(TGW)?_?ATTACH(MENT)?', '', cleaned_name)
+    cleaned_name = ATTACHMENT_WORD_RE.sub('', cleaned_name)
     
     # 4. 'VPC' を削除
     cleaned_name = cleaned_name.replace('_VPC', '')
@@ -180,28 +299,59 @@ def get_attach_cfn_prefix(attach_name: str) -> str:
     # GCOPM_ONPRE -> ONPRE および GCOPM_SHARED -> SHARED にするために、
     # 'GCOPM' + アンダースコア/空文字 が行頭にあれば削除します。
     # このロジックを適用することで、ONPRE/SHAREDの両方でGCOPMが削除されます。
-    cleaned_name = re.sub(r'^GCOPM_?', '', cleaned_name)
+    cleaned_name = GCOPM_PREFIX_RE.sub('', cleaned_name)
 
     # 6. 連続するアンダースコアを一つにまとめ、両端のアンダースコアを削除
-    cleaned_name = re.sub(r'_+', '_', cleaned_name).strip('_')
+    cleaned_name = MULTI_UNDERSCORE_RE.sub('_', cleaned_name).strip('_')
     
     # 7. 最後に残ったアンダースコアを削除し、全て英数字にする (cfn_resource_nameに合うよう結合)
-    return re.sub(r'[^A-Z0-9]+', '', cleaned_name)
+    return NON_UPPER_ALNUM_RE.sub('', cleaned_name)
     
 # --- YAMLダンプ結果のインデント処理ヘルパー関数 ---
 def indent_yaml_dump(dump_string: str, spaces: int = 2) -> str:
     """
     yaml.dumpで出力された文字列全体に指定されたスペース数でインデントを適用する。
     """
-    indent = " " * spaces
-    indented_lines = [indent + line for line in dump_string.splitlines()]
-    return "\n".join(indented_lines) + "\n"
+    # yaml.dumpの出力は改行で終わり空行を含まないため、行ごとの分割・再結合は textwrap.indent に任せる
+    return textwrap.indent(dump_string, " " * spaces)
+
+# --- YAML Dump カスタム設定 (Ref/GetAttのショートハンド化) ---
+def represent_cfn_tag(dumper: yaml.Dumper, data: Dict) -> yaml.Node:
+    """CFnの組み込み関数 (Fn::) や Ref をショートハンドタグ形式で出力する"""
+    # dict専用のrepresenterのため型判定は不要。単一キーのdictのみキーを1回取り出して判定する
+    if len(data) == 1:
+        key = next(iter(data))
+        value = data[key]
+        if key == 'Ref':
+            return dumper.represent_scalar('!Ref', value)
+        if key == 'Fn::GetAtt':
+            return dumper.represent_scalar('!GetAtt', f"{value[0]}.{value[1]}")
+    return dumper.represent_dict(data)
+
+def represent_sorted_set(dumper: yaml.Dumper, data: Set) -> yaml.Node:
+    """set (Propagation先のAttachment ID集合など) を順序の安定したリストとして出力する"""
+    return dumper.represent_list(sorted(data))
+
+class CustomDumper(YAML_BASE_DUMPER):
+    """CFnテンプレート出力用のDumper (representerはモジュールロード時に1度だけ登録する)"""
+    pass
+
+CustomDumper.add_representer(dict, represent_cfn_tag)
+CustomDumper.add_representer(set, represent_sorted_set)
 # ------------------------------
 
 # =================================================================
 # --- 4. コアデータ抽出ロジック ---
 # =================================================================
 
+def fetch_rtb_propagations(ec2_client: boto3.client, rtb_id: str) -> List[Dict[str, Any]]:
+    """1つのRTBのPropagation一覧を全ページ分取得する (スレッドプールから呼び出される)"""
+    paginator = ec2_client.get_paginator('get_transit_gateway_route_table_propagations')
+    propagations = []
+    for page in paginator.paginate(TransitGatewayRouteTableId=rtb_id):
+        propagations.extend(page.get('TransitGatewayRouteTablePropagations', []))
+    return propagations
+
 def get_tgw_configuration(tgw_id: str, ec2_client: boto3.client) -> Dict[str, Any]:
     """
     TGWのルートテーブル、アタッチメント、アソシエーション、伝播の全情報を取得する。
@@ -216,52 +366,71 @@ def get_tgw_configuration(tgw_id: str, ec2_client: boto3.client) -> Dict[str, An
         'propagations': {}  # {RTB_ID: {AttachmentId, ...}}
     }
     
+    # TGW IDと状態でのフィルタはサーバー側で適用する (RTB・アタッチメント共通)
+    tgw_filters = [
+        {'Name': 'transit-gateway-id', 'Values': [tgw_id]},
+        {'Name': 'state', 'Values': ['available']}
+    ]
+    
     # --- 1. ルートテーブルの取得 ---
-    rtb_response = ec2.describe_transit_gateway_route_tables(
-        Filters=[
-            {'Name': 'transit-gateway-id', 'Values': [tgw_id]},
-            {'Name': 'state', 'Values': ['available']}
-        ]
+    # 1回のレスポンスに収まらない場合に取りこぼさないよう、Paginatorで全ページを取得する
+    rtb_pages = ec2.get_paginator('describe_transit_gateway_route_tables').paginate(
+        Filters=tgw_filters,
+        PaginationConfig={'PageSize': DESCRIBE_PAGE_SIZE}
     )
-    for rtb in rtb_response.get('TransitGatewayRouteTables', []):
-        rtb_id = rtb['TransitGatewayRouteTableId']
-        rtb_name = next((tag['Value'] for tag in rtb.get('Tags', []) if tag['Key'] == 'Name'), None)
-        
-        if not rtb_name:
-            logger.warning(f"Skipping RTB {rtb_id} because it lacks a Name tag.")
-            continue
+    for page in rtb_pages:
+        for rtb in page.get('TransitGatewayRouteTables', []):
+            rtb_id = rtb['TransitGatewayRouteTableId']
+            rtb_tags = rtb.get('Tags', [])
+            tag_map = {tag['Key']: tag['Value'] for tag in rtb_tags}
+            rtb_name = tag_map.get('Name')
+        
+            if not rtb_name:
+                logger.warning("Skipping RTB %s because it lacks a Name tag.", rtb_id)
+                continue
             
-        config['rtbs'][rtb_id] = {
-            'RtbName': rtb_name,
-            'Tags': rtb.get('Tags', []) # 抽出した既存のタグをそのまま保持
-        }
-        config['propagations'][rtb_id] = set() 
+            config['rtbs'][rtb_id] = {
+                'RtbName': rtb_name,
+                # CFn論理ID (生成処理で毎回命名変換しないよう抽出時に算出しておく)
+                'CfnName': get_rtb_cfn_name(rtb_name),
+                'Tags': rtb_tags, # 抽出した既存のタグをそのまま保持
+                # CFnテンプレート用のタグ (自動生成タグとCFnメタデータを除外) をタグ走査時に合わせて作成
+                'FilteredTags': [
+                    tag for tag in rtb_tags
+                    if not tag['Key'].startswith('aws:cloudformation:') and
+                        tag['Key'] != 'AutoGenerated'
+                ]
+            }
+            config['propagations'][rtb_id] = set() 
 
     # --- 2. アタッチメントとアソシエーションの取得 ---
-    all_attachments_response = ec2.describe_transit_gateway_attachments(
-        Filters=[
-            {'Name': 'transit-gateway-id', 'Values': [tgw_id]},
-            {'Name': 'state', 'Values': ['available']}
-        ]
+    attachment_pages = ec2.get_paginator('describe_transit_gateway_attachments').paginate(
+        Filters=tgw_filters,
+        PaginationConfig={'PageSize': DESCRIBE_PAGE_SIZE}
     )
-    for attachment in all_attachments_response.get('TransitGatewayAttachments', []):
-        attach_id = attachment.get('TransitGatewayAttachmentId')
-        attach_name_tag = next((tag['Value'] for tag in attachment.get('Tags', []) if tag['Key'] == 'Name'), attach_id)
-        
-        config['attachments'][attach_id] = {
-            'ResourceOwnerId': attachment.get('ResourceOwnerId'), 
-            'AttachmentName': attach_name_tag,
-            'ResourceId': attachment.get('ResourceId'), 
-            'Tags': attachment.get('Tags', [])
-        }
+    for page in attachment_pages:
+        for attachment in page.get('TransitGatewayAttachments', []):
+            attach_id = attachment.get('TransitGatewayAttachmentId')
+            attach_tags = attachment.get('Tags', [])
+            tag_map = {tag['Key']: tag['Value'] for tag in attach_tags}
+            attach_name_tag = tag_map.get('Name', attach_id)
+        
+            config['attachments'][attach_id] = {
+                'ResourceOwnerId': attachment.get('ResourceOwnerId'), 
+                'AttachmentName': attach_name_tag,
+                # Association/PropagationのCFn論理ID用プレフィックス (抽出時に算出しておく)
+                'CfnPrefix': get_attach_cfn_prefix(attach_name_tag),
+                'ResourceId': attachment.get('ResourceId'), 
+                'Tags': attach_tags
+            }
         
-        # アソシエーション情報の収集
-        assoc = attachment.get('Association', {})
-        assoc_rtb_id = assoc.get('TransitGatewayRouteTableId')
-        if (assoc_rtb_id and 
-            assoc.get('State') == 'associated' and 
-            assoc_rtb_id in config['rtbs']):
-            config['associations'][attach_id] = assoc_rtb_id
+            # アソシエーション情報の収集
+            assoc = attachment.get('Association', {})
+            assoc_rtb_id = assoc.get('TransitGatewayRouteTableId')
+            if (assoc_rtb_id and 
+                assoc.get('State') == 'associated' and 
+                assoc_rtb_id in config['rtbs']):
+                config['associations'][attach_id] = assoc_rtb_id
 
     # --- 3. プロパゲーション情報の取得 ---
     API_METHOD_NAME = 'get_transit_gateway_route_table_propagations' 
@@ -269,76 +438,70 @@ def get_tgw_configuration(tgw_id: str, ec2_client: boto3.client) -> Dict[str, An
         logger.warning(
             f"Skipping Propagation data (API client lacks method): EC2 client lacks '{API_METHOD_NAME}'. Check Boto3 version/Lambda Runtime."
         )
-    else:
-        for rtb_id in config['rtbs'].keys():
-            try:
-                prop_response = ec2.get_transit_gateway_route_table_propagations(
-                    TransitGatewayRouteTableId=rtb_id
-                )
-                
-                for prop in prop_response.get('TransitGatewayRouteTablePropagations', []):
-                    prop_attach_id = prop['TransitGatewayAttachmentId']
+    elif config['rtbs']:
+        # RTBごとのAPI呼び出しは互いに独立しているため並列に発行する (boto3クライアントはスレッドセーフ)
+        max_workers = min(PROPAGATION_FETCH_MAX_WORKERS, len(config['rtbs']))
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = {
+                pool.submit(fetch_rtb_propagations, ec2, rtb_id): rtb_id
+                for rtb_id in config['rtbs']
+            }
+            for future in as_completed(futures):
+                rtb_id = futures[future]
+                try:
+                    for prop in future.result():
+                        prop_attach_id = prop['TransitGatewayAttachmentId']
+                        
+                        if prop.get('State') in ACTIVE_PROPAGATION_STATES and prop_attach_id in config['attachments']:
+                            config['propagations'][rtb_id].add(prop_attach_id)
                     
-                    if prop.get('State') in ACTIVE_PROPAGATION_STATES and prop_attach_id in config['attachments']:
-                        config['propagations'][rtb_id].add(prop_attach_id)
-                
-                logger.info(f"Propagation data successfully extracted for RTB {rtb_id}.")
-                
-            except ClientError as e:
-                error_code = e.response.get('Error', {}).get('Code')
-                logger.error(f"Propagation API call failed. Error Code: {error_code}. Check if assumed role has 'ec2:GetTransitGatewayRouteTablePropagations'.")
-            except Exception as e:
-                logger.error(f"UNEXPECTED ERROR during propagation fetching for RTB {rtb_id}: {traceback.format_exc()}")
+                    logger.info("Propagation data successfully extracted for RTB %s.", rtb_id)
+                    
+                except ClientError as e:
+                    error_code = e.response.get('Error', {}).get('Code')
+                    logger.error(f"Propagation API call failed. Error Code: {error_code}. Check if assumed role has 'ec2:GetTransitGatewayRouteTablePropagations'.")
+                except Exception as e:
+                    logger.error(f"UNEXPECTED ERROR during propagation fetching for RTB {rtb_id}: {traceback.format_exc()}")
                 
     return config
 
+def build_lookup_maps(config: Dict[str, Any]) -> Tuple[Dict[str, str], Dict[str, str], Dict[str, str]]:
+    """
+    成果物の生成処理で共通して参照するマッピングを1度だけ作成する。
+    (RTB ID -> RTB名, RTB ID -> CFn論理ID, Attachment ID -> CFn論理ID用プレフィックス) を返す。
+    """
+    rtb_name_map = {rtb_id: detail['RtbName'] for rtb_id, detail in config['rtbs'].items()}
+    rtb_ref_map = {rtb_id: detail['CfnName'] for rtb_id, detail in config['rtbs'].items()}
+    attach_prefix_map = {attach_id: detail['CfnPrefix'] for attach_id, detail in config['attachments'].items()}
+    return rtb_name_map, rtb_ref_map, attach_prefix_map
+
 # =================================================================
 # --- 5. CloudFormation YAMLコード生成ロジック ---
 # =================================================================
 
-def generate_cfn_yaml(config: Dict[str, Any], tgw_id: str, dynamic_prefix: str) -> str:
+def generate_cfn_yaml(config: Dict[str, Any], tgw_id: str, dynamic_prefix: str,
+                      rtb_ref_map: Dict[str, str], attach_prefix_map: Dict[str, str]) -> S3Payload:
     """
     取得したTGW設定から、CloudFormationのYAMLテンプレートを生成する。
+    rtb_ref_map / attach_prefix_map は build_lookup_maps で作成したものを受け取る。
+    アップロードは呼び出し元で他の成果物とまとめて行うため、(S3キー, 本文, Content-Type, gzip圧縮の要否) を返す。
     """
-    rtb_ref_map: Dict[str, str] = {}
     rtb_resources = {}
     assoc_resources = {}
     prop_resources = {}
     
-    # --- YAML Dump カスタム設定 (Ref/GetAttのショートハンド化) ---
-    def represent_cfn_tag(dumper: yaml.Dumper, data: Union[Dict, List]) -> yaml.ScalarNode:
-        """CFnの組み込み関数 (Fn::) や Ref をショートハンドタグ形式で出力する"""
-        if isinstance(data, dict) and len(data) == 1 and 'Ref' in data:
-            return dumper.represent_scalar('!Ref', data['Ref'])
-        if isinstance(data, dict) and len(data) == 1 and 'Fn::GetAtt' in data:
-            return dumper.represent_scalar('!GetAtt', f"{data['Fn::GetAtt'][0]}.{data['Fn::GetAtt'][1]}")
-        return dumper.represent_dict(data)
-
-    class CustomDumper(yaml.Dumper):
-        pass
-
-    CustomDumper.add_representer(dict, represent_cfn_tag)
-    
     # --- 5a. TransitGatewayRouteTable リソースの準備 ---
     for rtb_id, rtb_detail in config['rtbs'].items():
-        # RTB名からCFnリソース名を生成 
-        cfn_resource_name = get_rtb_cfn_name(rtb_detail['RtbName'])
-        rtb_ref_map[rtb_id] = cfn_resource_name
-        
-        # 🚨 修正点: 自動生成タグを削除し、CFnメタデータを削除
-        # AutoGeneratedを削除
-        filtered_tags = [
-            tag for tag in rtb_detail['Tags'] 
-            if not tag['Key'].startswith('aws:cloudformation:') and 
-                tag['Key'] != 'AutoGenerated'
-        ]
+        # RTB名から生成したCFnリソース名 (get_tgw_configurationで算出済み)
+        cfn_resource_name = rtb_ref_map[rtb_id]
         
         rtb_resources[cfn_resource_name] = {
             'Type': 'AWS::EC2::TransitGatewayRouteTable',
             'Properties': {
                 'TransitGatewayId': {'Ref': 'TransitGatewayId'},
-                # 抽出した既存のタグのみを使用
-                'Tags': filtered_tags 
+                # 🚨 修正点: 自動生成タグ (AutoGenerated) とCFnメタデータを除いた既存のタグのみを使用
+                # (除外処理は get_tgw_configuration で実施済み)
+                'Tags': rtb_detail['FilteredTags'] 
             },
             'DeletionPolicy': 'Retain' 
         }
@@ -348,10 +511,8 @@ def generate_cfn_yaml(config: Dict[str, Any], tgw_id: str, dynamic_prefix: str)
         rtb_cfn_name = rtb_ref_map.get(assoc_rtb_id)
         if not rtb_cfn_name: continue
         
-        attach_detail = config['attachments'][attach_id]
-        
-        # 💡 修正されたget_attach_cfn_prefixを使用
-        attach_prefix = get_attach_cfn_prefix(attach_detail['AttachmentName'])
+        # 💡 修正されたget_attach_cfn_prefixによるプレフィックス (get_tgw_configurationで算出済み)
+        attach_prefix = attach_prefix_map[attach_id]
         
         # 命名規則: TGW + プレフィックス + ASSOCIATETo + RTB名 
         cfn_resource_name = f'TGW{attach_prefix}ASSOCIATETo{rtb_cfn_name}'
@@ -372,10 +533,8 @@ def generate_cfn_yaml(config: Dict[str, Any], tgw_id: str, dynamic_prefix: str)
         if not rtb_cfn_name: continue
         
         for attach_id in prop_attach_ids:
-            attach_detail = config['attachments'][attach_id]
-            
-            # 💡 修正されたget_attach_cfn_prefixを使用
-            attach_prefix = get_attach_cfn_prefix(attach_detail['AttachmentName'])
+            # 💡 修正されたget_attach_cfn_prefixによるプレフィックス (get_tgw_configurationで算出済み)
+            attach_prefix = attach_prefix_map[attach_id]
             
             # 命名規則: TGW + プレフィックス + PROPAGATETo + RTB名 
             cfn_resource_name = f'TGW{attach_prefix}PROPAGATETo{rtb_cfn_name}'
@@ -405,79 +564,44 @@ def generate_cfn_yaml(config: Dict[str, Any], tgw_id: str, dynamic_prefix: str)
         }
     }
 
-    output_buffer = StringIO()
+    output_buffer = bytearray()
     
     # 1. ヘッダーとパラメータ
-    output_buffer.write(yaml.dump(cfn_header, sort_keys=False, default_flow_style=False))
+    output_buffer.extend(yaml.dump(cfn_header, Dumper=YAML_BASE_DUMPER, sort_keys=False, default_flow_style=False).encode('utf-8'))
 
     # Resources: キーを出力
-    output_buffer.write("Resources:\n")
+    output_buffer.extend(RESOURCES_KEY_B)
 
     # 2. RTBリソースと区切りコメント
-    output_buffer.write(RTB_SEP)
+    output_buffer.extend(RTB_SEP_B)
     rtb_dump = yaml.dump(rtb_resources, Dumper=CustomDumper, sort_keys=False, default_flow_style=False, indent=2)
-    output_buffer.write(indent_yaml_dump(rtb_dump, 2))
+    output_buffer.extend(indent_yaml_dump(rtb_dump, 2).encode('utf-8'))
 
     # 3. Associationリソースと区切りコメント
-    output_buffer.write(ASSOC_SEP)
+    output_buffer.extend(ASSOC_SEP_B)
     assoc_dump = yaml.dump(assoc_resources, Dumper=CustomDumper, sort_keys=False, default_flow_style=False, indent=2)
-    output_buffer.write(indent_yaml_dump(assoc_dump, 2))
+    output_buffer.extend(indent_yaml_dump(assoc_dump, 2).encode('utf-8'))
 
     # 4. Propagationリソースと区切りコメント
-    output_buffer.write(PROP_SEP)
+    output_buffer.extend(PROP_SEP_B)
     prop_dump = yaml.dump(prop_resources, Dumper=CustomDumper, sort_keys=False, default_flow_style=False, indent=2)
-    output_buffer.write(indent_yaml_dump(prop_dump, 2))
+    output_buffer.extend(indent_yaml_dump(prop_dump, 2).encode('utf-8'))
     
-    yaml_string = output_buffer.getvalue()
-    
-    # S3へのアップロード
+    # S3へのアップロード対象 (バッファはstrに戻さずバイト列のまま渡す)
     cfn_s3_key = f"{dynamic_prefix}/cfn/{CFN_YAML_FILENAME}"
-    upload_to_s3(YAML_BUCKET, cfn_s3_key, yaml_string, 'text/yaml')
-    
-    return f"s3://{YAML_BUCKET}/{cfn_s3_key}"
-
-# =================================================================
-# --- 6. マッピングテーブル JSONL 生成ロジック ---
-def generate_mapping_table(config: Dict[str, Any], dynamic_prefix: str) -> str:
-    """
-    TGWの設定情報から、AttachmentとAssociationに基づいたマッピングテーブル（JSONL形式）を生成する。
-    """
-    jsonl_output = StringIO()
-    rtb_name_map = {rtb_id: detail['RtbName'] for rtb_id, detail in config['rtbs'].items()}
-    
-    for attach_id, assoc_rtb_id in config['associations'].items():
-        attach_detail = config['attachments'][attach_id]
-        
-        output_data = {
-            "account-id": attach_detail.get('ResourceOwnerId'),
-            "tgw-attach-id": attach_id,
-            "rtb-name": rtb_name_map.get(assoc_rtb_id)
-        }
-        
-        if not output_data.get("rtb-name"):
-            logger.warning(f"Skipping mapping for {attach_id}: Associated RTB {assoc_rtb_id} name not found.")
-            continue
-            
-        output_data["rtb-name"] = output_data["rtb-name"].strip()
-        json_output = json.dumps(output_data, ensure_ascii=False, separators=(',', ':'))
-        jsonl_output.write(json_output + '\n')
-            
-    jsonl_data = jsonl_output.getvalue()
-    
-    # S3へのアップロード
-    mapping_s3_key = f"{dynamic_prefix}/extractsheet/{MAPPING_TABLE_FILENAME}"
-    upload_to_s3(YAML_BUCKET, mapping_s3_key, jsonl_data, 'application/jsonl')
-    
-    return f"s3://{YAML_BUCKET}/{mapping_s3_key}"
+    # テンプレートはCloudFormationがTemplateURLから直接読み込むため圧縮しない
+    return cfn_s3_key, output_buffer, 'text/yaml', False
 
 # =================================================================
-# --- 7. タスクJSONL生成ロジック ---
+# --- 6. タスクIDサフィックス抽出ロジック ---
+# 同じRTB名がAssociation/Propagationタスクごとに繰り返し渡されるため、RTB名単位で結果をキャッシュする
+@functools.lru_cache(maxsize=512)
 def extract_rtb_suffix(rtb_name: str) -> str:
     """
     RTB名からタスクIDに使用するサフィックス部分（例: 'asp03-01' や 'onpre'）を抽出する。
     """
     # 1. '-tokyo-' と '-rtb$' の間の部分を抽出
-    match = re.search(r'-tokyo-([a-zA-Z0-9_-]+)-rtb$', rtb_name.strip())
+    match = RTB_SUFFIX_RE.search(rtb_name.strip())
     
     if match:
         suffix = match.group(1).upper()
@@ -491,154 +615,145 @@ def extract_rtb_suffix(rtb_name: str) -> str:
     # --- ユーザーの要望に基づくクリーニング ---
     
     # 1. 冗長な接尾辞 _TGW を削除 (例: ASP01_01_TGW -> ASP01_01)
-    cleaned_suffix = re.sub(r'_TGW$', '', cleaned_suffix)
+    if cleaned_suffix.endswith('_TGW'):
+        cleaned_suffix = cleaned_suffix[:-len('_TGW')]
     
     # 2. 冗長な接頭辞 GCOPM_ を削除 (例: GCOPM_ONPRE -> ONPRE)
-    cleaned_suffix = re.sub(r'^GCOPM_', '', cleaned_suffix)
+    if cleaned_suffix.startswith('GCOPM_'):
+        cleaned_suffix = cleaned_suffix[len('GCOPM_'):]
     
     # 最後に残った非英数字を削除 & 連続するアンダースコアを一つにまとめる & 両端のアンダースコアを削除
-    cleaned_suffix = re.sub(r'[^A-Z0-9_]+', '', cleaned_suffix)
-    return cleaned_suffix.replace('__', '_').strip('_')
+    # (連続するアンダースコアは長さに関わらず一つにまとめる。例: A___B -> A_B)
+    cleaned_suffix = NON_UPPER_ALNUM_UNDERSCORE_RE.sub('', cleaned_suffix)
+    return MULTI_UNDERSCORE_RE.sub('_', cleaned_suffix).strip('_')
 
-
-def generate_task_jsonl(config: Dict[str, Any], dynamic_prefix: str) -> str:
+# =================================================================
+# --- 7. マッピングテーブル / タスクJSONL / CFnインポートマッピング JSON 生成ロジック ---
+def generate_extractsheet_artifacts(config: Dict[str, Any], dynamic_prefix: str, rtb_name_map: Dict[str, str],
+                                    rtb_ref_map: Dict[str, str], attach_prefix_map: Dict[str, str]) -> Tuple[S3Payload, S3Payload, S3Payload]:
     """
-    TGWの設定情報から、Association/Propagationタスクリスト（JSONL形式）を生成する。
+    TGWの設定情報から、以下の3つの成果物を1回の走査でまとめて生成する。
+    - AttachmentとAssociationに基づいたマッピングテーブル（JSONL形式）
+    - Association/Propagationタスクリスト（JSONL形式）
+    - CloudFormationリソースインポートに必要な物理IDと論理IDのマッピングJSON
+    rtb_name_map / rtb_ref_map / attach_prefix_map は build_lookup_maps で作成したものを受け取る。
+    それぞれ (S3キー, 本文, Content-Type, gzip圧縮の要否) を (マッピング, タスク, インポートマッピング) の順で返す。
     """
-    task_list = []
+    mapping_records: List[bytes] = []
+    task_list: List[Dict[str, Any]] = []
+    resources_to_import: List[Dict[str, Any]] = []
+    
+    # TransitGatewayRouteTable のインポートマッピングを追加
+    for rtb_id, rtb_cfn_name in rtb_ref_map.items():
+        resources_to_import.append({
+            'ResourceType': 'AWS::EC2::TransitGatewayRouteTable',
+            'LogicalResourceId': rtb_cfn_name,
+            'ResourceIdentifier': {'TransitGatewayRouteTableId': rtb_id}
+        })
     
-    rtb_name_map = {rtb_id: detail['RtbName'] for rtb_id, detail in config['rtbs'].items()}
     attach_assoc_rtb_map = config['associations']
     
-    # Association タスクの生成
+    # Association: マッピングテーブル / Associationタスク / インポートマッピングを生成
     for attach_id, assoc_rtb_id in config['associations'].items():
+        attach_detail = config['attachments'][attach_id]
         rtb_name = rtb_name_map.get(assoc_rtb_id)
-        if not rtb_name: continue
-            
-        rtb_suffix = extract_rtb_suffix(rtb_name) 
-        task_id = f"TGW_{rtb_suffix}_ASSOCIATE"
         
-        task_list.append({
-            "task_id": task_id,
-            "rtb_name": rtb_name,
-            "attachment_id": attach_id,
-            "target_attachment_id": None,
-            "action": "associate"
-        })
-
-    # Propagation タスクの生成
-    for rtb_id, prop_attach_ids in config['propagations'].items():
-        for target_attach_id in prop_attach_ids:
-            # Propagate先のAttachmentが、Associationを持っているか確認
-            assoc_rtb_id = attach_assoc_rtb_map.get(target_attach_id)
-            if not assoc_rtb_id: continue 
-            
-            assoc_rtb_name = rtb_name_map.get(assoc_rtb_id)
-            if not assoc_rtb_name: continue
-
-            rtb_suffix = extract_rtb_suffix(assoc_rtb_name) 
-            task_id = f"TGW_{rtb_suffix}_PROPAGATE"
+        if not rtb_name:
+            logger.warning("Skipping mapping for %s: Associated RTB %s name not found.", attach_id, assoc_rtb_id)
+        else:
+            mapping_records.append(json_dumps({
+                "account-id": attach_detail.get('ResourceOwnerId'),
+                "tgw-attach-id": attach_id,
+                "rtb-name": rtb_name.strip()
+            }))
             
+            rtb_suffix = extract_rtb_suffix(rtb_name) 
             task_list.append({
-                "task_id": task_id,
-                "rtb_name": rtb_name_map.get(rtb_id), 
-                "attachment_id": None,
-                "target_attachment_id": target_attach_id, 
-                "action": "propagate"
+                "task_id": f"TGW_{rtb_suffix}_ASSOCIATE",
+                "rtb_name": rtb_name,
+                "attachment_id": attach_id,
+                "target_attachment_id": None,
+                "action": "associate"
             })
-            
-    jsonl_output = StringIO()
-    for task in task_list:
-        jsonl_output.write(json.dumps(task, ensure_ascii=False, separators=(',', ':')) + '\n')
         
-    jsonl_data = jsonl_output.getvalue()
-    
-    # S3へのアップロード
-    task_s3_key = f"{dynamic_prefix}/extractsheet/{TASK_JSONL_FILENAME}"
-    upload_to_s3(YAML_BUCKET, task_s3_key, jsonl_data, 'application/jsonl')
-    
-    return f"s3://{YAML_BUCKET}/{task_s3_key}"
-# -----------------------------------
-
-# =================================================================
-# --- 8. CFnインポートマッピング JSON生成ロジック ---
-def generate_import_mapping_json(config: Dict[str, Any], dynamic_prefix: str) -> str:
-    """
-    CloudFormationリソースインポートに必要な物理IDと論理IDのマッピングJSONを生成する。
-    """
-    resources_to_import: List[Dict[str, Any]] = []
-    
-    # RTB IDとCFn論理IDのマッピングを生成
-    rtb_ref_map: Dict[str, str] = {}
-    for rtb_id, rtb_detail in config['rtbs'].items():
-        rtb_cfn_name = get_rtb_cfn_name(rtb_detail['RtbName'])
-        rtb_ref_map[rtb_id] = rtb_cfn_name
-        
-        # 1. TransitGatewayRouteTable のインポートマッピングを追加
-        resources_to_import.append({
-            'ResourceType': 'AWS::EC2::TransitGatewayRouteTable',
-            'LogicalResourceId': rtb_cfn_name,
-            'ResourceIdentifier': {'TransitGatewayRouteTableId': rtb_id}
-        })
-
-    # TransitGatewayRouteTableAssociation のインポートマッピングを追加
-    for attach_id, assoc_rtb_id in config['associations'].items():
         rtb_cfn_name = rtb_ref_map.get(assoc_rtb_id)
         if not rtb_cfn_name: continue
         
-        attach_detail = config['attachments'][attach_id]
-        # 💡 修正されたget_attach_cfn_prefixを使用
-        attach_prefix = get_attach_cfn_prefix(attach_detail['AttachmentName'])
+        # 💡 修正されたget_attach_cfn_prefixによるプレフィックス (get_tgw_configurationで算出済み)
+        attach_prefix = attach_prefix_map[attach_id]
         
         # 論理IDの生成: TGW + プレフィックス + ASSOCIATETo + RTB名
-        cfn_resource_name = f'TGW{attach_prefix}ASSOCIATETo{rtb_cfn_name}'
-        
         resources_to_import.append({
             'ResourceType': 'AWS::EC2::TransitGatewayRouteTableAssociation',
-            'LogicalResourceId': cfn_resource_name,
+            'LogicalResourceId': f'TGW{attach_prefix}ASSOCIATETo{rtb_cfn_name}',
             'ResourceIdentifier': {
                 'TransitGatewayAttachmentId': attach_id,
                 'TransitGatewayRouteTableId': assoc_rtb_id
             }
         })
 
-    # TransitGatewayRouteTablePropagation のインポートマッピングを追加
+    # Propagate先として有効な (名前の判明しているRTBにAssociationを持つ) Attachmentと、
+    # そのAssociation先RTBのタスクIDサフィックスを事前に求めておく
+    assoc_target_to_suffix = {
+        attach_id: extract_rtb_suffix(rtb_name_map[assoc_rtb_id])
+        for attach_id, assoc_rtb_id in attach_assoc_rtb_map.items()
+        if rtb_name_map.get(assoc_rtb_id)
+    }
+    
+    # Propagation: Propagationタスク / インポートマッピングを生成
     for rtb_id, prop_attach_ids in config['propagations'].items():
         rtb_cfn_name = rtb_ref_map.get(rtb_id)
-        if not rtb_cfn_name: continue
         
         for attach_id in prop_attach_ids:
-            attach_detail = config['attachments'][attach_id]
-            # 💡 修正されたget_attach_cfn_prefixを使用
-            attach_prefix = get_attach_cfn_prefix(attach_detail['AttachmentName'])
+            # Propagate先のAttachmentが、Associationを持っているか確認
+            rtb_suffix = assoc_target_to_suffix.get(attach_id)
+            if rtb_suffix is not None:
+                task_list.append({
+                    "task_id": f"TGW_{rtb_suffix}_PROPAGATE",
+                    "rtb_name": rtb_name_map.get(rtb_id), 
+                    "attachment_id": None,
+                    "target_attachment_id": attach_id, 
+                    "action": "propagate"
+                })
             
-            # 論理IDの生成: TGW + プレフィックス + PROPAGATETo + RTB名
-            cfn_resource_name = f'TGW{attach_prefix}PROPAGATETo{rtb_cfn_name}'
+            if not rtb_cfn_name: continue
+            
+            # 💡 修正されたget_attach_cfn_prefixによるプレフィックス (get_tgw_configurationで算出済み)
+            attach_prefix = attach_prefix_map[attach_id]
             
+            # 論理IDの生成: TGW + プレフィックス + PROPAGATETo + RTB名
             resources_to_import.append({
                 'ResourceType': 'AWS::EC2::TransitGatewayRouteTablePropagation',
-                'LogicalResourceId': cfn_resource_name,
+                'LogicalResourceId': f'TGW{attach_prefix}PROPAGATETo{rtb_cfn_name}',
                 'ResourceIdentifier': {
                     'TransitGatewayAttachmentId': attach_id,
                     'TransitGatewayRouteTableId': rtb_id
                 }
             })
-            
-    # JSONとして出力
-    json_data = json.dumps(resources_to_import, indent=2, ensure_ascii=False)
-    
-    # S3へのアップロード
-    import_s3_key = f"{dynamic_prefix}/extractsheet/{IMPORT_MAPPING_FILENAME}"
-    upload_to_s3(YAML_BUCKET, import_s3_key, json_data, 'application/json')
     
-    return f"s3://{YAML_BUCKET}/{import_s3_key}"
+    # JSONLはシリアライズ済みのレコードを一度だけ結合する (末尾は改行で終える)
+    mapping_data = b"\n".join(mapping_records) + b"\n" if mapping_records else b""
+    task_data = b"\n".join(map(json_dumps, task_list)) + b"\n" if task_list else b""
+    # インポートマッピングはtg2 Lambdaが機械的に読み込むのみのため、インデントなしのコンパクトなJSONとして出力
+    import_data = json_dumps(resources_to_import)
+    
+    # S3へのアップロード対象
+    return (
+        # マッピングテーブル / タスクJSONLは他のLambda (br3 / br1) からも直接読み込まれるため圧縮しない
+        (f"{dynamic_prefix}/extractsheet/{MAPPING_TABLE_FILENAME}", mapping_data, 'application/jsonl', False),
+        (f"{dynamic_prefix}/extractsheet/{TASK_JSONL_FILENAME}", task_data, 'application/jsonl', False),
+        # インポートマッピングの読み込み元はtg2 Lambdaのみ (ContentEncodingを確認して解凍する) のため、gzip圧縮する
+        (f"{dynamic_prefix}/extractsheet/{IMPORT_MAPPING_FILENAME}", import_data, 'application/json', True)
+    )
 
 # =================================================================
-# --- 9. メインディスパッチャ (Lambda専用) ---
+# --- 8. メインディスパッチャ (Lambda専用) ---
 def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """AWS Lambdaエントリーポイント (直接呼び出しを想定)"""
     
-    logger.info(f"Received event: {json.dumps(event)}")
+    # イベント全体のJSONシリアライズはINFOログが有効な場合のみ行う
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("Received event: %s", json.dumps(event))
     
     # dynamic_prefix の動的参照を取得
     dynamic_prefix = event.get('dynamic_prefix')
@@ -676,17 +791,27 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         if not config['rtbs']:
             return {'status': 'FAILURE', 'message': f"No available TGW Route Tables found for TGW ID: {tgw_id} in account {owner_account_id}"}
             
-        # 3. CloudFormation YAMLの生成とアップロード
-        cfn_s3_path = generate_cfn_yaml(config, tgw_id, dynamic_prefix)
+        # 各成果物の生成で共通して参照するマッピングを1度だけ作成
+        rtb_name_map, rtb_ref_map, attach_prefix_map = build_lookup_maps(config)
+        
+        # 3. CloudFormation YAMLの生成
+        cfn_payload = generate_cfn_yaml(config, tgw_id, dynamic_prefix, rtb_ref_map, attach_prefix_map)
         
-        # 4. マッピングテーブル JSONLの生成とアップロード
-        mapping_table_s3_path = generate_mapping_table(config, dynamic_prefix)
+        # 4-6. マッピングテーブル JSONL / Task JSONL / CFnインポートマッピング JSONを1回の走査で生成
+        mapping_table_payload, task_jsonl_payload, import_mapping_payload = generate_extractsheet_artifacts(
+            config, dynamic_prefix, rtb_name_map, rtb_ref_map, attach_prefix_map
+        )
         
-        # 5. Task JSONLの生成とアップロード
-        task_jsonl_s3_path = generate_task_jsonl(config, dynamic_prefix)
+        # 7. CFn YAML / マッピングテーブル / Task JSONLは互いに独立しているため、S3へ並列でアップロードする
+        upload_payloads_to_s3([cfn_payload, mapping_table_payload, task_jsonl_payload])
+        # cfn_import_mapping.jsonのS3イベントがtg2のトリガーとなるため、
+        # tg2が参照するCFn YAMLのアップロード完了後に最後にアップロードする
+        upload_to_s3(YAML_BUCKET, *import_mapping_payload)
         
-        # 6. CFnインポートマッピング JSONの生成とアップロード
-        import_mapping_s3_path = generate_import_mapping_json(config, dynamic_prefix)
+        cfn_s3_path = f"s3://{YAML_BUCKET}/{cfn_payload[0]}"
+        mapping_table_s3_path = f"s3://{YAML_BUCKET}/{mapping_table_payload[0]}"
+        task_jsonl_s3_path = f"s3://{YAML_BUCKET}/{task_jsonl_payload[0]}"
+        import_mapping_s3_path = f"s3://{YAML_BUCKET}/{import_mapping_payload[0]}"
 
         success_message = (
             f"TGW configuration successfully exported from account {owner_account_id}. "
@@ -2,12 +2,19 @@ import json
 import os
 import boto3
 import datetime
+import gzip
 import time
 from botocore.config import Config
-from botocore.exceptions import ClientError, WaiterError
-from typing import Dict, Any, Union, List
+from botocore.exceptions import ClientError
+from typing import Dict, Any, Iterator, Union, List, Optional, Tuple
 from urllib.parse import unquote_plus # URLデコードのために追加
 
+try:
+    # Lambdaレイヤーで提供されている場合のみ高速なorjsonを使用する (未導入の環境では標準のjsonを使用)
+    import orjson
+except ImportError:
+    orjson = None
+
 # =========================================================================
 # Configuration (Environment Variables and Constants)
 # =========================================================================
@@ -25,25 +32,48 @@ REGION = 'ap-northeast-1'
 TGW_ID_CONFIG_FILENAME = "tgw_id_config.jsonl"
 CFN_IMPORT_MAPPING_FILENAME = "cfn_import_mapping.json" 
 
+# Boto3クライアント (グローバルに定義し、ウォームコンテナ間で再利用する)
+s3 = boto3.client('s3', config=Config(retries={'max_attempts': 3}))
+sts = boto3.client('sts', region_name=REGION)
+
+# AssumeRoleで取得した一時認証情報のキャッシュ (ウォームコンテナ間で再利用し、STS呼び出しを省略する)
+# キー: (account_id, role_name, service) -> (一時認証情報, 有効期限)
+ASSUMED_ROLE_CREDENTIALS_CACHE: Dict[Tuple[str, str, str], Tuple[Dict[str, Any], datetime.datetime]] = {}
+# 一時認証情報の残り有効期間がこれを下回る場合はAssumeRoleをやり直す
+ASSUMED_ROLE_REFRESH_MARGIN = datetime.timedelta(minutes=5)
+
+# Change Set / スタック操作の完了待機でのポーリング間隔 (秒)
+# 通常数秒で完了するため初回は短い間隔で確認し、以降は最後の値の間隔でポーリングを続ける
+POLL_DELAYS_SECONDS = (1, 1, 2, 3, 5)
+# 待機時間の上限 (秒)
+CHANGE_SET_WAIT_TIMEOUT_SECONDS = 150
+STACK_OPERATION_WAIT_TIMEOUT_SECONDS = 600
+
 # =========================================================================
 # Helper Functions
 # =========================================================================
 
 def assume_role_and_get_client(account_id: str, role_name: str, service: str, region: str):
     """ターゲットアカウントにAssumeRoleし、指定されたサービス用のクライアントを返す。"""
+    cache_key = (account_id, role_name, service)
     try:
-        # 1. AssumeRole実行
-        sts_client = boto3.client('sts', region_name=region)
-        session_name = f"{service.replace(':', '')}DeploymentSession"
-        
-        print(f"[INFO] Attempting to AssumeRole: arn:aws:iam::{account_id}:role/{role_name}")
-        assumed_role_object = sts_client.assume_role(
-            RoleArn=f"arn:aws:iam::{account_id}:role/{role_name}",
-            RoleSessionName=session_name
-        )
-        credentials = assumed_role_object['Credentials']
-        
-        print(f"[INFO] Successfully assumed role in account {account_id} for {service} deployment.")
+        # 1. キャッシュ済みの認証情報が十分な有効期間を残していれば再利用し、なければAssumeRole実行
+        cached = ASSUMED_ROLE_CREDENTIALS_CACHE.get(cache_key)
+        if cached and cached[1] - datetime.datetime.now(datetime.timezone.utc) > ASSUMED_ROLE_REFRESH_MARGIN:
+            credentials = cached[0]
+            print(f"[INFO] Reusing cached credentials for account {account_id} (expires at {cached[1].isoformat()}).")
+        else:
+            session_name = f"{service.replace(':', '')}DeploymentSession"
+            
+            print(f"[INFO] Attempting to AssumeRole: arn:aws:iam::{account_id}:role/{role_name}")
+            assumed_role_object = sts.assume_role(
+                RoleArn=f"arn:aws:iam::{account_id}:role/{role_name}",
+                RoleSessionName=session_name
+            )
+            credentials = assumed_role_object['Credentials']
+            ASSUMED_ROLE_CREDENTIALS_CACHE[cache_key] = (credentials, credentials['Expiration'])
+            
+            print(f"[INFO] Successfully assumed role in account {account_id} for {service} deployment.")
         
         # 2. 認証情報を使用してクライアントを生成
         return boto3.client(
@@ -58,25 +88,41 @@ def assume_role_and_get_client(account_id: str, role_name: str, service: str, re
         print(f"[ERROR] Failed to assume role in account {account_id}: {e}")
         raise 
 
+def json_loads(data: Union[str, bytes]) -> Any:
+    """JSONをパースする (orjsonが利用可能な場合はbytesをデコードせずにそのままパースする)"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
 def fetch_s3_json_data(bucket: str, key: str) -> Union[Dict[str, Any], List[Any], None]:
     """S3からJSONファイルを読み込む"""
-    s3 = boto3.client('s3')
     try:
         print(f"[INFO] Attempting to fetch S3 data: s3://{bucket}/{key}")
         response = s3.get_object(Bucket=bucket, Key=key)
-        # JSONをパースして返す
-        content = response['Body'].read().decode('utf-8').strip()
+        # JSONをパースして返す (デコードせずにバイト列のままパースする)
+        content = response['Body'].read()
+        # 抽出Lambdaはサイズの大きいインポートマッピングをgzip圧縮してアップロードするため、解凍してからパースする
+        if response.get('ContentEncoding') == 'gzip':
+            content = gzip.decompress(content)
+        content = content.strip()
         if not content:
              return None
              
-        # JSONLまたは単一JSONオブジェクトに対応するため、try-exceptでパースを試みる
+        # JSONL (1行目が完結したJSONオブジェクトで、後続の行がある) の場合は、全体のパースを試みず最初の行のみをパースする
+        # ※ JSON配列 (cfn_import_mapping.json) やインデント付きのJSONは、1行目が '[' で始まるか '{' のみとなるため、この判定には該当しない
+        first_line, has_more_lines, _ = content.partition(b'\n')
+        first_line = first_line.strip()
+        if has_more_lines and first_line.startswith(b'{') and first_line.endswith(b'}'):
+            return json_loads(first_line)
+        
+        # 単一JSONに対応するため、try-exceptでパースを試みる
+        # (orjson.JSONDecodeErrorはjson.JSONDecodeErrorのサブクラス)
         try:
-            return json.loads(content)
+            return json_loads(content)
         except json.JSONDecodeError:
             # JSONL形式で、複数行ある場合は最初の行のみパースを試みる
-            first_line = content.split('\n')[0].strip()
             if first_line:
-                return json.loads(first_line)
+                return json_loads(first_line)
             return None
             
     except ClientError as e:
@@ -116,65 +162,81 @@ def get_tgw_and_account_id(bucket: str, prefix: str) -> Dict[str, str]:
         'target_account_id': str(account_id)
     }
 
+def get_stack_status(cfn_client, stack_name: str) -> Optional[str]:
+    """
+    スタックの現在のステータスを返す。スタックが存在しない場合はNoneを返す。
+    存在確認とステータス取得を1回のDescribeStacksで兼ねる。
+    """
+    try:
+        response = cfn_client.describe_stacks(StackName=stack_name)
+    except ClientError as e:
+        error = e.response.get('Error', {})
+        if error.get('Code') == 'ValidationError' and 'does not exist' in error.get('Message', ''):
+            return None
+        raise
+    return response['Stacks'][0]['StackStatus']
+
+def iter_poll_delays(timeout_seconds: int) -> Iterator[int]:
+    """ポーリング前の待機秒数を、待機時間の合計が上限に達するまで順に返す"""
+    elapsed = 0
+    for attempt in range(timeout_seconds):
+        delay = POLL_DELAYS_SECONDS[min(attempt, len(POLL_DELAYS_SECONDS) - 1)]
+        elapsed += delay
+        if elapsed > timeout_seconds:
+            return
+        yield delay
+
 def wait_for_change_set(cfn_client, stack_name: str, change_set_id: str, request_id: str):
     """変更セットの作成完了を待機し、失敗した場合は詳細をログに出力する。"""
+    print(f"[INFO] {request_id} Waiting for Change Set {change_set_id} to complete...")
     
-    waiter = cfn_client.get_waiter('change_set_create_complete')
-    
-    try:
-        print(f"[INFO] {request_id} Waiting for Change Set {change_set_id} to complete...")
-        waiter.wait(
+    status = None
+    for delay in iter_poll_delays(CHANGE_SET_WAIT_TIMEOUT_SECONDS):
+        time.sleep(delay)
+        response = cfn_client.describe_change_set(
             ChangeSetName=change_set_id,
-            StackName=stack_name,
-            WaiterConfig={
-                'Delay': 5,
-                'MaxAttempts': 30
-            }
+            StackName=stack_name
         )
-        print(f"[INFO] {request_id} Change Set {change_set_id} created successfully.")
-    except WaiterError as e:
-        try:
-            response = cfn_client.describe_change_set(
-                ChangeSetName=change_set_id,
-                StackName=stack_name
-            )
-            status = response.get('Status')
+        status = response.get('Status')
+        
+        if status == 'CREATE_COMPLETE':
+            print(f"[INFO] {request_id} Change Set {change_set_id} created successfully.")
+            return
+        if status == 'FAILED':
             status_reason = response.get('StatusReason', 'No reason provided.')
             error_msg = f"Change Set creation FAILED: {status_reason} Status: {status}"
-        except ClientError as describe_e:
-            error_msg = f"Change Set creation FAILED. Could not get details: {describe_e}"
-            
-        print(f"[ERROR] {request_id} {error_msg}")
-        raise Exception(error_msg) from e
+            print(f"[ERROR] {request_id} {error_msg}")
+            raise Exception(error_msg)
+    
+    error_msg = f"Change Set creation FAILED: Timed out after {CHANGE_SET_WAIT_TIMEOUT_SECONDS} seconds. Status: {status}"
+    print(f"[ERROR] {request_id} {error_msg}")
+    raise Exception(error_msg)
 
 
 def wait_for_stack_operation(cfn_client, stack_name: str, operation_type: str, request_id: str):
     """スタック操作（IMPORT/UPDATE）の完了を待機する"""
+    print(f"[INFO] {request_id} Waiting for stack {stack_name} to complete {operation_type}...")
     
-    waiter_name = 'stack_import_complete' if operation_type == 'IMPORT' else 'stack_update_complete'
-    waiter = cfn_client.get_waiter(waiter_name)
-    
-    try:
-        print(f"[INFO] {request_id} Waiting for stack {stack_name} to complete {operation_type}...")
-        waiter.wait(
-            StackName=stack_name,
-            WaiterConfig={
-                'Delay': 10,
-                'MaxAttempts': 60 # 10分
-            }
-        )
-        print(f"[INFO] {request_id} Stack {stack_name} completed {operation_type}_COMPLETE successfully.")
-    except WaiterError as e:
-        try:
-            response = cfn_client.describe_stacks(StackName=stack_name)['Stacks'][0]
-            stack_status = response.get('StackStatus')
+    success_status = f"{operation_type}_COMPLETE"
+    stack_status = None
+    for delay in iter_poll_delays(STACK_OPERATION_WAIT_TIMEOUT_SECONDS):
+        time.sleep(delay)
+        response = cfn_client.describe_stacks(StackName=stack_name)['Stacks'][0]
+        stack_status = response.get('StackStatus')
+        
+        if stack_status == success_status:
+            print(f"[INFO] {request_id} Stack {stack_name} completed {success_status} successfully.")
+            return
+        # 進行中以外のステータス (FAILED / ROLLBACK_COMPLETE など) は失敗として扱う
+        if not stack_status.endswith('_IN_PROGRESS'):
             stack_reason = response.get('StackStatusReason', 'No reason provided.')
             error_msg = f"Stack {operation_type} FAILED: Final Status: {stack_status}, Reason: {stack_reason}"
-        except ClientError:
-            error_msg = f"Stack {operation_type} FAILED. Could not retrieve final stack status."
-            
-        print(f"[ERROR] {request_id} {error_msg}")
-        raise Exception(error_msg) from e
+            print(f"[ERROR] {request_id} {error_msg}")
+            raise Exception(error_msg)
+    
+    error_msg = f"Stack {operation_type} FAILED: Timed out after {STACK_OPERATION_WAIT_TIMEOUT_SECONDS} seconds. Last Status: {stack_status}"
+    print(f"[ERROR] {request_id} {error_msg}")
+    raise Exception(error_msg)
 
 
 # =========================================================================
@@ -253,10 +315,8 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         # ★★★ 修正終わり ★★★
         
         # 6. スタック名とテンプレートURLの決定
-        sanitized_prefix = dynamic_prefix.replace('_', '-')
-        today_date_str = datetime.datetime.now().strftime('%Y%m%d')
-        dynamic_suffix = f"{CFN_STACK_SUFFIX_BASE}-{today_date_str}"
-        stack_name = f"{sanitized_prefix}{dynamic_suffix}"
+        # スタック名: dynamic_prefix (アンダースコアはハイフンに置換) + サフィックス + 日付 (YYYYMMDD)
+        stack_name = f"{dynamic_prefix.replace('_', '-')}{CFN_STACK_SUFFIX_BASE}-{datetime.date.today():%Y%m%d}"
         
         # テンプレートは {dynamic_prefix}/cfn/ の下に置かれていると仮定
         template_key = f"{dynamic_prefix}/cfn/{CFN_YAML_FILENAME}"
@@ -267,15 +327,11 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         
         # 7. ChangeSetタイプを決定 (IMPORTまたはUPDATE)
         change_set_type = 'IMPORT'
-        try:
-            cfn_client.describe_stacks(StackName=stack_name)
+        if get_stack_status(cfn_client, stack_name) is not None:
             change_set_type = 'UPDATE'
             print(f"[INFO] {request_id} Stack {stack_name} exists. Creating UPDATE Change Set.")
-        except ClientError as e:
-            if 'does not exist' in str(e):
-                print(f"[INFO] {request_id} Stack {stack_name} does not exist. Creating IMPORT Change Set.")
-            else:
-                raise e
+        else:
+            print(f"[INFO] {request_id} Stack {stack_name} does not exist. Creating IMPORT Change Set.")
                 
         # 8. IMPORTだがリソースがない場合は実行しない
         if change_set_type == 'IMPORT' and not resources_to_import: